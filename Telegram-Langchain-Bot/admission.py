@@ -0,0 +1,252 @@
+"""Admission control for the Wallmart bot: overload detection and degradation levels."""
+import os, logging, time, asyncio
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from statistics import median
+
+logger = logging.getLogger(__name__)
+
+# Degradation levels, applied in order as load rises.
+NORMAL, NO_BUY, SHORT_VOICE_ONLY, SEARCH_CACHE_ONLY, LLM_CACHE_ONLY, BUSY = range(6)
+LEVEL_NAMES = ["normal", "no_buy", "short_voice_only",
+               "search_cache_only", "llm_cache_only", "busy"]
+# Pressure needed to enter each level; a level is left once pressure drops
+# EXIT_GAP below its entry point and it has been held for HOLD_SECONDS.
+LEVEL_ENTER = [0.0, 0.6, 0.75, 0.9, 1.1, 1.4]
+EXIT_GAP = 0.2
+
+LAG_BUDGET = float(os.getenv("ADMISSION_LAG_BUDGET", "0.5"))        # seconds
+QUEUE_BUDGET = int(os.getenv("ADMISSION_QUEUE_BUDGET", "20"))       # pending updates
+ERROR_BUDGET = float(os.getenv("ADMISSION_ERROR_BUDGET", "0.5"))    # failure ratio
+# An upstream recovers once its error rate drops this far below ERROR_BUDGET.
+UPSTREAM_EXIT_GAP = 0.2
+HOLD_SECONDS = float(os.getenv("ADMISSION_HOLD_SECONDS", "15"))
+VOICE_MAX_SECONDS = int(os.getenv("ADMISSION_VOICE_MAX_SECONDS", "20"))
+
+# Feature -> (level that sheds it, upstream it depends on)
+FEATURES = {
+    "message": (BUSY, None),
+    "buy": (NO_BUY, None),
+    "voice": (SHORT_VOICE_ONLY, "whisper"),
+    "search": (SEARCH_CACHE_ONLY, "serpapi"),
+    "llm": (LLM_CACHE_ONLY, "gemini"),
+}
+
+# Outcome of an admission check; `reason` is None when allowed.
+Gate = namedtuple("Gate", "allowed reason retry_after")
+OPEN = Gate(True, None, 0)
+
+class TTLCache:
+    """Small LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float, maxsize: int = 256, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data = OrderedDict()
+
+    def get(self, key):
+        hit = self._data.get(key)
+        if hit is None or self.clock() - hit[0] > self.ttl:
+            self._data.pop(key, None)
+            return None
+        self._data.move_to_end(key)
+        return hit[1]
+
+    def put(self, key, value):
+        self._data[key] = (self.clock(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+class AdmissionController:
+    """Map event-loop lag and queue depth to a global degradation level.
+
+    Upstream error rates are tracked separately per upstream, so a failing
+    service only degrades the feature that depends on it.
+    """
+
+    def __init__(self, window: float = 60.0, interval: float = 0.5, lag_samples: int = 10,
+                 hold_seconds: float = HOLD_SECONDS, clock=time.monotonic):
+        self.window = window
+        self.interval = interval
+        self.hold_seconds = hold_seconds
+        self.clock = clock
+        self.level = NORMAL
+        self.changed_at = clock()
+        self.lag = 0.0
+        self.queue_depth = 0
+        self.results = {}
+        self.upstreams = {}
+        self.metrics = {"level": NORMAL, "transitions": 0, "shed": {}, "upstreams": {}}
+        self._lag_samples = deque(maxlen=lag_samples)
+
+    @contextmanager
+    def track(self, upstream: str):
+        """Record whether an upstream call succeeded or raised."""
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.results.setdefault(upstream, deque()).append((self.clock(), ok))
+            self._refresh_upstream(upstream)
+
+    def record_lag(self, sample: float):
+        """Add a lag sample; the median keeps one long stall from looking like overload."""
+        self._lag_samples.append(sample)
+        self.lag = median(self._lag_samples)
+
+    def _samples(self, upstream: str):
+        samples = self.results.get(upstream, deque())
+        cutoff = self.clock() - self.window
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        return samples
+
+    def error_rate(self, upstream: str) -> float:
+        samples = self._samples(upstream)
+        if not samples:
+            return 0.0
+        return sum(1 for _, ok in samples if not ok) / len(samples)
+
+    def _refresh_upstream(self, upstream: str):
+        """Switch an upstream's degraded flag on or off, with hysteresis."""
+        now = self.clock()
+        samples = self._samples(upstream)
+        rate = self.error_rate(upstream)
+        state = self.upstreams.setdefault(
+            upstream, {"degraded": False, "since": now, "probe_at": now})
+        if not state["degraded"]:
+            switch = len(samples) >= 5 and rate >= ERROR_BUDGET
+        else:
+            # Only a successful probe, after the hold, can clear the flag
+            switch = (samples and samples[-1][1]
+                      and rate < ERROR_BUDGET - UPSTREAM_EXIT_GAP
+                      and now - state["since"] >= self.hold_seconds)
+        if switch:
+            state.update(degraded=not state["degraded"], since=now, probe_at=now)
+            logger.warning(
+                "Upstream %s %s (error_rate=%.2f over %d calls)", upstream,
+                "degraded" if state["degraded"] else "recovered", rate, len(samples),
+            )
+        self.metrics["upstreams"][upstream] = {
+            "error_rate": round(rate, 3), "degraded": state["degraded"]}
+
+    def upstream_degraded(self, upstream: str) -> bool:
+        """True while `upstream` is degraded, except for one probe call per hold period."""
+        state = self.upstreams.get(upstream)
+        if not state or not state["degraded"]:
+            return False
+        now = self.clock()
+        if now - state["probe_at"] >= self.hold_seconds:
+            state["probe_at"] = now
+            logger.info(f"Probing degraded upstream {upstream}")
+            return False
+        return True
+
+    def upstream_retry_after(self, upstream: str) -> int:
+        """Seconds until the next probe of a degraded `upstream` is allowed."""
+        state = self.upstreams.get(upstream)
+        if not state:
+            return 1
+        return int(max(0.0, state["probe_at"] + self.hold_seconds - self.clock())) + 1
+
+    def pressure(self) -> float:
+        return max(self.lag / LAG_BUDGET, self.queue_depth / QUEUE_BUDGET)
+
+    def update(self):
+        score = self.pressure()
+        now = self.clock()
+        level = self.level
+        # Escalate straight to the highest level crossed, relax one step at a time
+        while level < BUSY and score >= LEVEL_ENTER[level + 1]:
+            level += 1
+        if (level == self.level and level > NORMAL
+                and score < LEVEL_ENTER[level] - EXIT_GAP
+                and now - self.changed_at >= self.hold_seconds):
+            level -= 1
+        self.metrics.update(pressure=round(score, 3), lag=round(self.lag, 3),
+                            queue=self.queue_depth)
+        for upstream in list(self.upstreams):
+            self._refresh_upstream(upstream)
+        if level != self.level:
+            logger.warning(
+                "Admission level %s -> %s (pressure=%.2f lag=%.3fs queue=%d)",
+                LEVEL_NAMES[self.level], LEVEL_NAMES[level], score,
+                self.lag, self.queue_depth,
+            )
+            self.level = level
+            self.changed_at = now
+            self.metrics["level"] = level
+            self.metrics["transitions"] += 1
+
+    def shed(self, what: str, reason: str = None):
+        """Count a request that was degraded or refused."""
+        self.metrics["shed"][what] = self.metrics["shed"].get(what, 0) + 1
+        logger.info(f"Shed '{what}' ({reason or 'level ' + LEVEL_NAMES[self.level]})")
+
+    def retry_after(self, level: int = None) -> int:
+        """Best-case seconds until the bot relaxes below `level` (default: current level)."""
+        level = self.level if level is None else level
+        steps = max(1, self.level - level + 1)
+        remaining = max(0.0, self.hold_seconds - (self.clock() - self.changed_at))
+        return int(remaining + (steps - 1) * self.hold_seconds) + 1
+
+    def gate(self, feature: str, voice_seconds: int = 0) -> Gate:
+        """Decide whether `feature` may run now, given the level and its upstream."""
+        min_level, upstream = FEATURES[feature]
+        if self.level >= BUSY:
+            return Gate(False, "busy", self.retry_after(BUSY))
+        # Only long voice notes are shed by level; short ones wait for BUSY
+        if self.level >= min_level and (feature != "voice" or voice_seconds > VOICE_MAX_SECONDS):
+            return Gate(False, f"level {LEVEL_NAMES[self.level]}", self.retry_after(min_level))
+        # Checked last so a probe is only spent when the call will really go out
+        if upstream and self.upstream_degraded(upstream):
+            return Gate(False, f"{upstream} errors", self.upstream_retry_after(upstream))
+        return OPEN
+
+    async def monitor(self, app):
+        """Sample loop lag and update-queue depth until cancelled."""
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record_lag(max(0.0, loop.time() - t0 - self.interval))
+            self.queue_depth = app.update_queue.qsize()
+            self.update()
+            if loop.time() - last_report >= 60:
+                logger.info(f"Admission metrics: {self.metrics}")
+                last_report = loop.time()
+
+def search_from_cache(ctl: AdmissionController, cache: TTLCache, key: str):
+    """Return (products, gate). Cached products are served at any level; on a
+    miss, `products` is None and `gate` says whether a live search may run."""
+    products = cache.get(key)
+    if products is not None:
+        return products, OPEN
+    return None, ctl.gate("search")
+
+def llm_from_cache(ctl: AdmissionController, cache: TTLCache, key: str, canned: str):
+    """Return (answer, gate). While the LLM is shed, answer from cache or with
+    `canned`; otherwise `answer` is None and Gemini should be called."""
+    gate = ctl.gate("llm")
+    if gate.allowed:
+        return None, gate
+    return cache.get(key) or canned, gate
+
+def shed_message(feature: str, gate: Gate) -> str:
+    """User-facing reply for a feature refused by `gate`."""
+    wait = gate.retry_after
+    if gate.reason == "busy":
+        return f"⏳ I'm busy right now, please retry in {wait} s."
+    if feature == "buy":
+        return f"🚧 Auto‑checkout is paused while I'm busy, please retry in {wait} s."
+    if feature == "voice" and gate.reason == "whisper errors":
+        return ("🎙️ Voice notes aren't working right now, please type your question "
+                f"or retry in {wait} s.")
+    if feature == "voice":
+        return (f"🎙️ I'm busy, so I can only take voice notes up to {VOICE_MAX_SECONDS} s "
+                f"right now. Please send a shorter one, type your question, or retry in {wait} s.")
+    return f"🔎 Product search is paused right now, please retry in {wait} s."
@@ -15,6 +15,10 @@ from serpapi import GoogleSearch
 import whisper, requests
 from pydub import AudioSegment
 
+from admission import (
+    AdmissionController, TTLCache, search_from_cache, llm_from_cache, shed_message,
+)
+
 # ---------- Env & logging ----------
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -65,6 +69,10 @@ def serp_products(query: str, num=3):
         "tbm": "shop"  # Google Shopping
     }
     res = GoogleSearch(params).get_dict()
+    # SerpAPI reports quota/rate-limit failures in the payload instead of raising
+    error = res.get("error")
+    if error and "hasn't returned any results" not in error:
+        raise RuntimeError(f"SerpAPI error: {error}")
     items = res.get("shopping_results") or []
     products = []
     for i, item in enumerate(items[:num], start=1):
@@ -84,6 +92,32 @@ async def log_order(user_id, text):
         "status": "pending"
     })
 
+# ---------- Admission control ----------
+admission = AdmissionController()
+search_cache = TTLCache(ttl=600)
+llm_cache = TTLCache(ttl=3600)
+
+CANNED_REPLY = (
+    "I'm handling a lot of requests right now, so I can only give short answers. "
+    "For product ideas try \"Suggest a phone under ₹15000\", or ask again in a bit!"
+)
+
+async def refuse(update: Update, feature: str, gate):
+    admission.shed(feature, reason=gate.reason)
+    await update.message.reply_text(shed_message(feature, gate))
+
+async def start_admission(app):
+    app.bot_data["admission_task"] = asyncio.create_task(admission.monitor(app))
+
+async def stop_admission(app):
+    task = app.bot_data.pop("admission_task", None)
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
 # ---------- Telegram handlers ----------
 async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -102,10 +136,15 @@ async def help_cmd(update: Update, ctx):
 
 # --- voice handler ---
 async def voice(update: Update, ctx):
+    gate = admission.gate("voice", voice_seconds=update.message.voice.duration)
+    if not gate.allowed:
+        await refuse(update, "voice", gate)
+        return
     voice_file = await ctx.bot.get_file(update.message.voice.file_id)
     with tempfile.NamedTemporaryFile(suffix=".oga", delete=False) as tmp:
         await voice_file.download_to_drive(tmp.name)
-        text = await asyncio.to_thread(transcribe_voice, tmp.name)
+        with admission.track("whisper"):
+            text = await asyncio.to_thread(transcribe_voice, tmp.name)
     logger.info(f"Voice -> '{text}'")
     # Inject transcribed text and reuse message handler
     update.message.text = text
@@ -116,11 +155,25 @@ async def handle(update: Update, ctx):
     msg = update.message.text
     user_id = update.effective_user.id
     low = msg.lower()
+    key = " ".join(low.split())
+
+    gate = admission.gate("message")
+    if not gate.allowed:
+        await refuse(update, "message", gate)
+        return
 
     try:
         # Product intent (very naive check)
         if any(word in low for word in ["suggest", "buy", "phone", "laptop", "under", "₹", "rs"]):
-            prods = serp_products(msg, num=3)
+            prods, gate = search_from_cache(admission, search_cache, key)
+            if prods is None:
+                if not gate.allowed:
+                    await refuse(update, "search", gate)
+                    return
+                with admission.track("serpapi"):
+                    prods = await asyncio.to_thread(serp_products, msg, 3)
+                if prods:
+                    search_cache.put(key, prods)
             if not prods:
                 await update.message.reply_text("Sorry, couldn't find matching products.")
                 return
@@ -141,24 +194,24 @@ async def handle(update: Update, ctx):
 
         # Fallback to Gemini
         else:
-            response = await chain.ainvoke({"question": msg})
-            await update.message.reply_text(str(response))
+            # Cached answers are only served when degraded, to keep replies fresh otherwise
+            answer, gate = llm_from_cache(admission, llm_cache, key, CANNED_REPLY)
+            if not gate.allowed:
+                admission.shed("llm", reason=gate.reason)
+            else:
+                with admission.track("gemini"):
+                    response = await chain.ainvoke({"question": msg})
+                answer = str(response)
+                llm_cache.put(key, answer)
+            await update.message.reply_text(answer)
 
     except Exception as e:
         logger.exception(e)
         await update.message.reply_text("Sorry, something went wrong.")
 
 # ---------- /buy demo command ----------
-async def buy_cmd(update: Update, ctx):
-    """Demo: start a headless Selenium checkout (user already logged‑in)."""
-    url = ctx.args[0] if ctx.args else None
-    if not url:
-        await update.message.reply_text("Usage: /buy <flipkart-product-url>")
-        return
-    await update.message.reply_text(
-        "🚧 Auto‑checkout demo starting …\n(This will only work on a machine "
-        "where a Selenium driver is configured and you’re logged‑in.)"
-    )
+def add_to_cart(url: str):
+    """Open `url` in headless Chrome and click 'Add to cart' (blocking)."""
     # Lazy import Selenium to avoid heavy dep if not used
     from selenium import webdriver
     from selenium.webdriver.chrome.options import Options
@@ -171,20 +224,42 @@ async def buy_cmd(update: Update, ctx):
         # TODO: adapt selectors; Flipkart changes often!
         add_btn = driver.find_element("xpath", "//button[contains(.,'Add to cart')]")
         add_btn.click()
-        await update.message.reply_text("Item added to cart ✅ (demo).")
         # driver.find_element(...).click() -> proceed to checkout
-    except Exception as e:
-        await update.message.reply_text(f"Automation failed: {e}")
     finally:
         driver.quit()
 
+async def buy_cmd(update: Update, ctx):
+    """Demo: start a headless Selenium checkout (user already logged‑in)."""
+    url = ctx.args[0] if ctx.args else None
+    if not url:
+        await update.message.reply_text("Usage: /buy <flipkart-product-url>")
+        return
+    gate = admission.gate("buy")
+    if not gate.allowed:
+        await refuse(update, "buy", gate)
+        return
+    await update.message.reply_text(
+        "🚧 Auto‑checkout demo starting …\n(This will only work on a machine "
+        "where a Selenium driver is configured and you’re logged‑in.)"
+    )
+    try:
+        # Selenium blocks for seconds; keep it off the event loop
+        await asyncio.to_thread(add_to_cart, url)
+        await update.message.reply_text("Item added to cart ✅ (demo).")
+    except Exception as e:
+        await update.message.reply_text(f"Automation failed: {e}")
+
 # ---------- main ----------
 def main():
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token or not SERP_KEY:
         raise RuntimeError("Check TELEGRAM_BOT_TOKEN and SERPAPI_KEY in .env")
 
-    app = ApplicationBuilder().token(token).build()
+    app = (
+        ApplicationBuilder().token(token)
+        .post_init(start_admission).post_shutdown(stop_admission)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("buy", buy_cmd))
@@ -0,0 +1,236 @@
+import pytest
+
+import logging
+
+from admission import (
+    AdmissionController, TTLCache, LAG_BUDGET, QUEUE_BUDGET, VOICE_MAX_SECONDS,
+    NORMAL, NO_BUY, SHORT_VOICE_ONLY, SEARCH_CACHE_ONLY, LLM_CACHE_ONLY, BUSY,
+    LEVEL_ENTER, EXIT_GAP, search_from_cache, llm_from_cache, shed_message,
+)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def ctl(clock):
+    return AdmissionController(hold_seconds=15, clock=clock)
+
+def set_pressure(ctl, pressure):
+    ctl.queue_depth = 0
+    ctl._lag_samples.clear()
+    ctl.record_lag(pressure * LAG_BUDGET)
+    ctl.update()
+
+def test_escalates_straight_to_highest_level_crossed(ctl):
+    set_pressure(ctl, 0.5)
+    assert ctl.level == NORMAL
+    set_pressure(ctl, 1.5)
+    assert ctl.level == BUSY
+
+def test_relaxes_one_step_per_hold_period(ctl, clock):
+    set_pressure(ctl, 1.5)
+    clock.now += 14
+    set_pressure(ctl, 0.0)
+    assert ctl.level == BUSY
+
+    levels = []
+    for _ in range(BUSY):
+        clock.now += 15
+        set_pressure(ctl, 0.0)
+        levels.append(ctl.level)
+    assert levels == [LLM_CACHE_ONLY, SEARCH_CACHE_ONLY, SHORT_VOICE_ONLY, NO_BUY, NORMAL]
+
+def test_exit_gap_holds_level_near_threshold(ctl, clock):
+    set_pressure(ctl, LEVEL_ENTER[SEARCH_CACHE_ONLY])
+    assert ctl.level == SEARCH_CACHE_ONLY
+    clock.now += 60
+    set_pressure(ctl, LEVEL_ENTER[SEARCH_CACHE_ONLY] - EXIT_GAP + 0.01)
+    assert ctl.level == SEARCH_CACHE_ONLY
+    set_pressure(ctl, LEVEL_ENTER[SEARCH_CACHE_ONLY] - EXIT_GAP - 0.01)
+    assert ctl.level == SEARCH_CACHE_ONLY - 1
+
+def test_single_stall_does_not_escalate(ctl):
+    for sample in [0.0] * 9 + [3.5]:
+        ctl.record_lag(sample)
+        ctl.update()
+    assert ctl.level == NORMAL
+
+def test_sustained_lag_escalates(ctl):
+    for _ in range(10):
+        ctl.record_lag(LAG_BUDGET)
+        ctl.update()
+    assert ctl.level == SEARCH_CACHE_ONLY
+
+def test_queue_depth_drives_level(ctl):
+    ctl.queue_depth = QUEUE_BUDGET
+    ctl.update()
+    assert ctl.level == SEARCH_CACHE_ONLY
+
+def call(ctl, upstream, ok):
+    try:
+        with ctl.track(upstream):
+            if not ok:
+                raise RuntimeError("upstream failed")
+    except RuntimeError:
+        pass
+
+def test_upstream_errors_degrade_only_that_upstream(ctl, clock):
+    for _ in range(5):
+        call(ctl, "gemini", ok=False)
+        call(ctl, "serpapi", ok=True)
+    ctl.update()
+    assert ctl.level == NORMAL
+    assert ctl.upstream_degraded("gemini")
+    assert not ctl.upstream_degraded("serpapi")
+    assert ctl.metrics["upstreams"]["gemini"] == {"error_rate": 1.0, "degraded": True}
+    assert ctl.metrics["upstreams"]["serpapi"] == {"error_rate": 0.0, "degraded": False}
+
+def test_dead_upstream_only_lets_probes_through(ctl, clock):
+    calls = []
+    for _ in range(300):
+        clock.now += 1
+        if not ctl.upstream_degraded("gemini"):
+            calls.append(clock.now)
+            call(ctl, "gemini", ok=False)
+    # Five calls trip the switch, then one probe per hold period
+    assert len(calls) == 5 + (300 - 5) // 15
+    assert all(b - a >= 15 for a, b in zip(calls[5:], calls[6:]))
+    assert ctl.upstreams["gemini"]["degraded"]
+
+def test_upstream_near_error_budget_does_not_flap(ctl, clock):
+    outcomes = iter([False, True] * 300)
+    flips, degraded = 0, False
+    for _ in range(300):
+        clock.now += 1
+        if not ctl.upstream_degraded("serpapi"):
+            call(ctl, "serpapi", ok=next(outcomes))
+        ctl.update()
+        if ctl.upstreams["serpapi"]["degraded"] != degraded:
+            degraded = not degraded
+            flips += 1
+    assert flips == 1
+
+def test_upstream_recovers_after_successful_probes(ctl, clock):
+    for _ in range(5):
+        clock.now += 1
+        call(ctl, "gemini", ok=False)
+    assert ctl.upstreams["gemini"]["degraded"]
+    for _ in range(120):
+        clock.now += 1
+        if not ctl.upstream_degraded("gemini"):
+            call(ctl, "gemini", ok=True)
+    assert not ctl.upstreams["gemini"]["degraded"]
+    assert not ctl.upstream_degraded("gemini")
+
+def test_upstream_state_changes_are_logged(ctl, clock, caplog):
+    with caplog.at_level(logging.WARNING, logger="admission"):
+        for _ in range(5):
+            call(ctl, "whisper", ok=False)
+    assert "Upstream whisper degraded" in caplog.text
+
+def test_shed_logs_reason(ctl, caplog):
+    with caplog.at_level(logging.INFO, logger="admission"):
+        ctl.shed("search", reason="serpapi errors")
+    assert "Shed 'search' (serpapi errors)" in caplog.text
+    assert ctl.metrics["shed"] == {"search": 1}
+
+def closed_features(ctl):
+    checks = {
+        "buy": ctl.gate("buy"),
+        "long_voice": ctl.gate("voice", voice_seconds=VOICE_MAX_SECONDS + 1),
+        "short_voice": ctl.gate("voice", voice_seconds=VOICE_MAX_SECONDS),
+        "search": ctl.gate("search"),
+        "llm": ctl.gate("llm"),
+        "message": ctl.gate("message"),
+    }
+    return {name for name, gate in checks.items() if not gate.allowed}
+
+def test_features_are_shed_in_order(ctl):
+    expected = [
+        set(),
+        {"buy"},
+        {"buy", "long_voice"},
+        {"buy", "long_voice", "search"},
+        {"buy", "long_voice", "search", "llm"},
+        {"buy", "long_voice", "short_voice", "search", "llm", "message"},
+    ]
+    for level, closed in enumerate(expected):
+        ctl.level = level
+        assert closed_features(ctl) == closed, level
+
+def test_gate_reports_reason_and_retry(ctl, clock):
+    set_pressure(ctl, LEVEL_ENTER[NO_BUY])
+    gate = ctl.gate("buy")
+    assert gate.reason == "level no_buy"
+    assert gate.retry_after == 16
+    assert "retry in 16 s" in shed_message("buy", gate)
+
+    set_pressure(ctl, 1.5)
+    gate = ctl.gate("search")
+    assert gate.reason == "busy"
+    assert shed_message("search", gate) == "⏳ I'm busy right now, please retry in 16 s."
+
+def test_gate_degraded_upstream(ctl, clock):
+    for _ in range(5):
+        call(ctl, "whisper", ok=False)
+    clock.now += 5
+    gate = ctl.gate("voice", voice_seconds=1)
+    assert gate.reason == "whisper errors"
+    assert gate.retry_after == 11
+    assert "Voice notes aren't working" in shed_message("voice", gate)
+
+def test_search_served_from_cache_when_degraded(ctl, clock):
+    cache = TTLCache(ttl=600, clock=clock)
+    cache.put("phone", [{"name": "P1"}])
+    ctl.level = SEARCH_CACHE_ONLY
+    assert search_from_cache(ctl, cache, "phone") == ([{"name": "P1"}], (True, None, 0))
+    products, gate = search_from_cache(ctl, cache, "laptop")
+    assert products is None and not gate.allowed
+    assert "Product search is paused" in shed_message("search", gate)
+
+def test_llm_cache_only_used_when_degraded(ctl, clock):
+    cache = TTLCache(ttl=600, clock=clock)
+    cache.put("hi", "Hello!")
+    answer, gate = llm_from_cache(ctl, cache, "hi", "canned")
+    assert answer is None and gate.allowed
+
+    ctl.level = LLM_CACHE_ONLY
+    assert llm_from_cache(ctl, cache, "hi", "canned")[0] == "Hello!"
+    assert llm_from_cache(ctl, cache, "other", "canned")[0] == "canned"
+
+    ctl.level = NORMAL
+    for _ in range(5):
+        call(ctl, "gemini", ok=False)
+    answer, gate = llm_from_cache(ctl, cache, "hi", "canned")
+    assert answer == "Hello!" and gate.reason == "gemini errors"
+
+def test_retry_after_counts_remaining_steps(ctl, clock):
+    set_pressure(ctl, 1.5)
+    clock.now += 5
+    assert ctl.retry_after() == 11
+    assert ctl.retry_after(NO_BUY) == 10 + 4 * 15 + 1
+
+def test_ttl_cache_expires(clock):
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.put("q", [1])
+    clock.now += 10
+    assert cache.get("q") == [1]
+    clock.now += 1
+    assert cache.get("q") is None
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    cache = TTLCache(ttl=10, maxsize=2, clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3